@@ -0,0 +1,62 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Compiled single-pass parser for the Prometheus samples metrics_logger needs.
+
+Build in place next to metrics_logger.py with:
+
+    cythonize -i _metrics_parse.pyx
+
+metrics_logger falls back to its pure-Python parser when this module has
+not been built.
+"""
+from libc.string cimport memchr
+
+
+cpdef dict parse_wanted_samples(const unsigned char[:] buf, dict wanted,
+                                bytes success_name):
+    """
+    Same contract as metrics_logger._parse_wanted_samples_py, on bytes.
+
+    wanted maps sample names (bytes) to (result key, field) tuples. Samples
+    named success_name count as ('requests_completed', '') when their labels
+    contain finished_reason="stop". The first sample seen for a key wins.
+    """
+    cdef dict values = {}
+    cdef Py_ssize_t n = buf.shape[0]
+    cdef Py_ssize_t pos = 0, end, brace, close, vstart, vend
+    cdef const char *base
+    cdef const char *hit
+    cdef bytes name
+
+    if n == 0:
+        return values
+    base = <const char *>&buf[0]
+
+    while pos < n:
+        hit = <const char *>memchr(base + pos, ord('\n'), n - pos)
+        end = (hit - base) if hit != NULL else n
+
+        if end > pos and base[pos] != ord('#'):
+            hit = <const char *>memchr(base + pos, ord('{'), end - pos)
+            if hit != NULL:
+                brace = hit - base
+                name = base[pos:brace]
+                key = wanted.get(name)
+                if key is not None or name == success_name:
+                    # Labels end at the first '} '
+                    close = brace + 1
+                    while close + 1 < end and not (base[close] == ord('}') and base[close + 1] == ord(' ')):
+                        close += 1
+                    if close + 1 < end:
+                        if key is None and b'finished_reason="stop"' in base[brace + 1:close]:
+                            key = ('requests_completed', '')
+                        if key is not None and key not in values:
+                            vstart = close + 2
+                            vend = vstart
+                            while vend < end and base[vend] != ord(' '):
+                                vend += 1
+                            values[key] = float(base[vstart:vend])
+
+        pos = end + 1
+
+    return values
@@ -5,20 +5,53 @@ This checks for indirect indicators that images were included in requests.
 """
 
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+try:
+    import re2  # google-re2: linear-time multi-pattern matching
+except ImportError:
+    re2 = None
 
-def analyze_log_for_image_processing(log_file):
+# ASCII-only lowercase table: bytes.translate() runs as a single C loop and
+# avoids decoding the log into a str just to call .lower() on it
+_ASCII_LOWER = bytes.maketrans(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+                               b'abcdefghijklmnopqrstuvwxyz')
+
+# Vision encoder references, matched against the lowercased startup log
+_ENCODER_PATTERNS = (rb'vision.*model', rb'vision.*encoder', rb'vit', rb'clip')
+
+if re2 is not None:
+    _ENCODER_SET = re2.Set.SearchSet()
+    for _pattern in _ENCODER_PATTERNS:
+        _ENCODER_SET.Add(_pattern)
+    _ENCODER_SET.Compile()
+else:
+    _ENCODER_RE = re.compile(b'|'.join(_ENCODER_PATTERNS))
+
+
+def _has_encoder_reference(lowered):
+    """Return True if any vision encoder pattern occurs in the buffer."""
+    if re2 is not None:
+        return bool(_ENCODER_SET.Match(lowered))
+    return _ENCODER_RE.search(lowered) is not None
+
+
+def analyze_log_for_image_processing(log_file, stop_after=None):
     """
     Analyze a VLLM log file for signs of image processing.
 
+    If stop_after is set, scanning stops once that many requests with image
+    indicators have been found and 'stopped_early' is set in the results.
+
     Returns a dict with analysis results.
     """
     results = {
         'total_requests': 0,
         'likely_has_images': 0,
         'indicators': [],
-        'requests_analyzed': []
+        'requests_analyzed': [],
+        'stopped_early': False
     }
 
     with open(log_file, 'r') as f:
@@ -45,12 +78,15 @@ def analyze_log_for_image_processing(log_file):
         indicators = []
         has_image = False
 
+        # Lowercase once and reuse it for every case-insensitive check
+        lowered_log = request_log.lower()
+
         # 1. Check for image-related terms in prompt
-        if 'screenshot' in request_log.lower():
+        if 'screenshot' in lowered_log:
             indicators.append('mentions_screenshot')
             has_image = True
 
-        if 'browser_vision' in request_log.lower():
+        if 'browser_vision' in lowered_log:
             indicators.append('has_browser_vision')
             has_image = True
 
@@ -69,7 +105,7 @@ def analyze_log_for_image_processing(log_file):
             has_image = True
 
         # 3. Check for vision-related instructions
-        if 'analyze' in request_log.lower() and ('image' in request_log.lower() or 'visual' in request_log.lower()):
+        if 'analyze' in lowered_log and ('image' in lowered_log or 'visual' in lowered_log):
             indicators.append('vision_analysis_task')
             has_image = True
 
@@ -79,6 +115,9 @@ def analyze_log_for_image_processing(log_file):
                 'request_id': request_id,
                 'indicators': indicators
             })
+            if stop_after is not None and results['likely_has_images'] >= stop_after:
+                results['stopped_early'] = True
+                break
 
     return results
 
@@ -89,24 +128,29 @@ def check_vllm_startup_for_vision_model(log_file):
     """
     vision_indicators = []
 
-    with open(log_file, 'r') as f:
-        content = f.read()
+    # One read and one translate: the lowercased copy is needed anyway, so
+    # mapping the file first would only add a second full copy
+    with open(log_file, 'rb') as f:
+        raw = f.read()
+    has_internvl = b'InternVL' in raw
+    lowered = raw.translate(_ASCII_LOWER)
+    del raw
 
     # Check for vision model components
-    if 'InternVL' in content:
+    if has_internvl:
         vision_indicators.append('InternVL model detected')
 
-    if 'vision' in content.lower():
-        # Count vision-related mentions
-        vision_count = content.lower().count('vision')
+    # Count vision-related mentions
+    vision_count = lowered.count(b'vision')
+    if vision_count:
         vision_indicators.append(f'Vision mentioned {vision_count} times')
 
-    if 'image' in content.lower():
-        image_count = content.lower().count('image')
+    image_count = lowered.count(b'image')
+    if image_count:
         vision_indicators.append(f'Image mentioned {image_count} times')
 
     # Look for vision model loading
-    if re.search(r'vision.*model|vision.*encoder|vit|clip', content, re.IGNORECASE):
+    if _has_encoder_reference(lowered):
         vision_indicators.append('Vision encoder/model referenced')
 
     return vision_indicators
@@ -144,7 +188,22 @@ def analyze_request_params(log_file):
 
 def main():
     """Run all analyses on the VLLM logs."""
-    log_file = Path('/home/jiaheng/vllm_log/server.log')
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Detect image processing in VLLM logs")
+    parser.add_argument(
+        '--log-file',
+        default='/home/jiaheng/vllm_log/server.log',
+        help='VLLM server log to analyze'
+    )
+    parser.add_argument(
+        '--quick',
+        action='store_true',
+        help='Stop the per-request scan as soon as the verdict is decided'
+    )
+    args = parser.parse_args()
+
+    log_file = Path(args.log_file)
 
     if not log_file.exists():
         print(f"❌ Log file not found: {log_file}")
@@ -155,10 +214,23 @@ def main():
     print("=" * 70)
     print()
 
+    # The three analyses are independent scans of the same file, so run them
+    # in parallel worker processes and report the results in order.
+    # The per-request scan is the expensive one; its only contribution to the
+    # verdict is whether any request shows image indicators, so in quick mode
+    # it stops at the first such request.
+    stop_after = 1 if args.quick else None
+    with ProcessPoolExecutor(max_workers=3) as executor:
+        vision_future = executor.submit(check_vllm_startup_for_vision_model, log_file)
+        params_future = executor.submit(analyze_request_params, log_file)
+        results_future = executor.submit(analyze_log_for_image_processing, log_file, stop_after)
+        vision_indicators = vision_future.result()
+        param_findings = params_future.result()
+        results = results_future.result()
+
     # Analysis 1: Startup logs
     print("📋 1. Checking startup logs for vision model...")
     print("-" * 70)
-    vision_indicators = check_vllm_startup_for_vision_model(log_file)
     if vision_indicators:
         print("✓ Vision model indicators found:")
         for indicator in vision_indicators:
@@ -170,7 +242,6 @@ def main():
     # Analysis 2: Request parameters
     print("📋 2. Checking request parameters...")
     print("-" * 70)
-    param_findings = analyze_request_params(log_file)
     if param_findings:
         print("✓ Multimodal parameter indicators:")
         for finding in param_findings:
@@ -182,14 +253,16 @@ def main():
     # Analysis 3: Individual requests
     print("📋 3. Analyzing individual requests...")
     print("-" * 70)
-    results = analyze_log_for_image_processing(log_file)
 
     print(f"Total requests analyzed: {results['total_requests']}")
     print(f"Requests likely with images: {results['likely_has_images']}")
+    if results['stopped_early']:
+        print("(quick mode: scan stopped once the verdict was decided)")
 
     if results['likely_has_images'] > 0:
-        percentage = (results['likely_has_images'] / results['total_requests']) * 100
-        print(f"Percentage with images: {percentage:.1f}%")
+        if not results['stopped_early']:
+            percentage = (results['likely_has_images'] / results['total_requests']) * 100
+            print(f"Percentage with images: {percentage:.1f}%")
         print()
         print("Sample requests with image indicators:")
         for req in results['requests_analyzed'][:5]:  # Show first 5
@@ -6,6 +6,7 @@ This extends the basic handler to log metadata about image processing.
 import logging
 import os
 import re
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
 from per_request_handler import PerRequestFileHandler
@@ -16,12 +17,15 @@ class EnhancedPerRequestFileHandler(PerRequestFileHandler):
     Enhanced handler that logs additional metadata about multimodal requests.
     """
 
+    # Cap on per-request metadata kept for the close() summary (oldest dropped)
+    MAX_TRACKED_REQUESTS = 10_000
+
     def __init__(self, log_directory="/home/jiaheng/vllm_log/requests",
                  level=logging.INFO):
         super().__init__(log_directory, level)
 
         # Track metadata per request
-        self._request_metadata = {}
+        self._request_metadata = OrderedDict()
 
     def analyze_for_images(self, message):
         """
@@ -29,24 +33,27 @@ class EnhancedPerRequestFileHandler(PerRequestFileHandler):
 
         Returns dict with indicators found.
         """
+        # Lowercase once and reuse it for every case-insensitive check
+        lowered = message.lower()
+        prompt_length = len(message)
         indicators = {
-            'has_screenshot': 'screenshot' in message.lower(),
-            'has_browser_vision': 'browser_vision' in message.lower(),
+            'has_screenshot': 'screenshot' in lowered,
+            'has_browser_vision': 'browser_vision' in lowered,
             'has_image_tag': '<image>' in message,
             'has_image_url': 'image_url' in message,
-            'prompt_length': len(message),
-            'likely_multimodal': False
+            'prompt_length': prompt_length,
+            # Length is O(1), so test it first before the substring flags
+            'likely_multimodal': prompt_length > 20000
         }
 
         # Determine if likely multimodal
-        if any([
-            indicators['has_screenshot'],
-            indicators['has_browser_vision'],
-            indicators['has_image_tag'],
-            indicators['has_image_url'],
-            indicators['prompt_length'] > 20000
-        ]):
-            indicators['likely_multimodal'] = True
+        if not indicators['likely_multimodal']:
+            indicators['likely_multimodal'] = (
+                indicators['has_screenshot']
+                or indicators['has_browser_vision']
+                or indicators['has_image_tag']
+                or indicators['has_image_url']
+            )
 
         return indicators
 
@@ -63,8 +70,11 @@ class EnhancedPerRequestFileHandler(PerRequestFileHandler):
                 # Analyze for image indicators
                 indicators = self.analyze_for_images(message)
 
-                # Store metadata
+                # Store metadata, evicting the oldest entries
                 self._request_metadata[request_id] = indicators
+                self._request_metadata.move_to_end(request_id)
+                while len(self._request_metadata) > self.MAX_TRACKED_REQUESTS:
+                    self._request_metadata.popitem(last=False)
 
                 # Log the metadata
                 if indicators['likely_multimodal']:
@@ -10,9 +10,15 @@ Captures prefill time and decode time for each request by:
 import logging
 import re
 import json
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
 from pathlib import Path
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+
+# Request IDs of the two events; the substring checks in emit() pick the
+# event, so these only run on matching records
+_RECEIVED_RE = re.compile(r'Received request (chatcmpl-[a-f0-9]+):')
+_GENERATED_RE = re.compile(r'Generated response .*?(chatcmpl-[a-f0-9]+)')
 
 
 class EnhancedTaskHandler(logging.Handler):
@@ -26,6 +32,10 @@ class EnhancedTaskHandler(logging.Handler):
     - Per-token latency
     """
 
+    # Cap on requests awaiting a 'Generated response' log; the oldest are
+    # dropped so cancelled/missed responses cannot leak forever
+    MAX_PENDING_REQUESTS = 10_000
+
     def __init__(self, log_directory="/home/jiaheng/vllm_log/task_logs",
                  idle_timeout_minutes=5,
                  level=logging.INFO):
@@ -33,14 +43,14 @@ class EnhancedTaskHandler(logging.Handler):
         self.log_directory = Path(log_directory)
         self.log_directory.mkdir(parents=True, exist_ok=True)
 
-        self.idle_timeout = timedelta(minutes=idle_timeout_minutes)
+        self.idle_timeout_seconds = idle_timeout_minutes * 60
         self._current_task_id = None
         self._current_file = None
-        self._last_request_time = None
+        self._last_request_time = None  # time.monotonic() of the last record
         self._request_count = 0
 
         # Track request metrics
-        self._pending_requests = {}  # request_id -> start_time
+        self._pending_requests = OrderedDict()  # request_id -> start_time (LRU)
 
     def extract_step_info(self, message):
         """Extract step number from browser-use message."""
@@ -57,9 +67,10 @@ class EnhancedTaskHandler(logging.Handler):
         match = re.search(r'(chatcmpl-[a-f0-9]+)', message)
         return match.group(1) if match else None
 
-    def parse_received_request(self, message):
+    def parse_received_request(self, message, request_id=None):
         """Parse 'Received request' log to extract details."""
-        request_id = self.extract_request_id(message)
+        if request_id is None:
+            request_id = self.extract_request_id(message)
         if not request_id:
             return None
 
@@ -72,9 +83,10 @@ class EnhancedTaskHandler(logging.Handler):
             'has_prompt': bool(prompt_match)
         }
 
-    def parse_generated_response(self, message):
+    def parse_generated_response(self, message, request_id=None):
         """Parse 'Generated response' log to extract timing metrics."""
-        request_id = self.extract_request_id(message)
+        if request_id is None:
+            request_id = self.extract_request_id(message)
         if not request_id:
             return None
 
@@ -99,7 +111,7 @@ class EnhancedTaskHandler(logging.Handler):
 
     def should_start_new_task(self, message):
         """Determine if we should start a new task file."""
-        now = datetime.now()
+        now = time.monotonic()
 
         # First request ever
         if self._current_task_id is None:
@@ -113,22 +125,27 @@ class EnhancedTaskHandler(logging.Handler):
                 return True
 
         # Check idle timeout
-        if self._last_request_time:
-            time_since_last = now - self._last_request_time
-            if time_since_last > self.idle_timeout:
+        if self._last_request_time is not None:
+            if now - self._last_request_time > self.idle_timeout_seconds:
                 return True
 
         return False
 
+    def _write_task_footer(self):
+        """Write the task-end footer to the current file in one call."""
+        self._current_file.write(
+            f"\n{'='*70}\n"
+            f"Task ended: {datetime.now().isoformat()}\n"
+            f"Total requests: {self._request_count}\n"
+            f"{'='*70}\n"
+        )
+
     def start_new_task(self):
         """Start a new task with a new file."""
         # Close current file
         if self._current_file:
             try:
-                self._current_file.write(f"\n{'='*70}\n")
-                self._current_file.write(f"Task ended: {datetime.now().isoformat()}\n")
-                self._current_file.write(f"Total requests: {self._request_count}\n")
-                self._current_file.write(f"{'='*70}\n")
+                self._write_task_footer()
                 self._current_file.close()
             except:
                 pass
@@ -141,16 +158,17 @@ class EnhancedTaskHandler(logging.Handler):
         log_file = self.log_directory / f"{self._current_task_id}.log"
         self._current_file = open(log_file, 'w', encoding='utf-8')
 
-        # Write header
-        self._current_file.write(f"{'='*70}\n")
-        self._current_file.write(f"Browser-Use Task Log with Timing Metrics\n")
-        self._current_file.write(f"Task ID: {self._current_task_id}\n")
-        self._current_file.write(f"Started: {datetime.now().isoformat()}\n")
-        self._current_file.write(f"{'='*70}\n\n")
-        self._current_file.flush()
+        # Write header (emit() flushes after the first record)
+        self._current_file.write(
+            f"{'='*70}\n"
+            f"Browser-Use Task Log with Timing Metrics\n"
+            f"Task ID: {self._current_task_id}\n"
+            f"Started: {datetime.now().isoformat()}\n"
+            f"{'='*70}\n\n"
+        )
 
         self._request_count = 0
-        self._pending_requests = {}
+        self._pending_requests = OrderedDict()
 
     def emit(self, record):
         """Emit a log record to the current task file."""
@@ -162,20 +180,24 @@ class EnhancedTaskHandler(logging.Handler):
                 self.start_new_task()
 
             # Update last request time
-            self._last_request_time = datetime.now()
+            self._last_request_time = time.monotonic()
 
             # Handle 'Received request' logs
             if 'Received request' in message:
-                req_info = self.parse_received_request(message)
+                match = _RECEIVED_RE.search(message)
+                req_info = self.parse_received_request(message, match.group(1) if match else None)
                 if req_info:
                     self._request_count += 1
                     request_id = req_info['request_id']
 
-                    # Store request start time
+                    # Store request start time, evicting the oldest entries
                     self._pending_requests[request_id] = {
                         'start_time': req_info['timestamp'],
                         'request_num': self._request_count
                     }
+                    self._pending_requests.move_to_end(request_id)
+                    while len(self._pending_requests) > self.MAX_PENDING_REQUESTS:
+                        self._pending_requests.popitem(last=False)
 
                     # Extract step info
                     step_info = self.extract_step_info(message)
@@ -189,7 +211,8 @@ class EnhancedTaskHandler(logging.Handler):
 
             # Handle 'Generated response' logs
             elif 'Generated response' in message:
-                resp_info = self.parse_generated_response(message)
+                match = _GENERATED_RE.search(message)
+                resp_info = self.parse_generated_response(message, match.group(1) if match else None)
                 if resp_info and resp_info['request_id'] in self._pending_requests:
                     request_id = resp_info['request_id']
                     req_data = self._pending_requests[request_id]
@@ -219,8 +242,13 @@ class EnhancedTaskHandler(logging.Handler):
                     # Clean up
                     del self._pending_requests[request_id]
 
-            # Write the original log message
-            formatted_msg = self.format(record)
+            # Write the original log message. Without a configured formatter
+            # the default one would just reproduce the cached message, so
+            # skip it unless there is exception/stack text to append.
+            if self.formatter is None and not record.exc_info and not record.stack_info:
+                formatted_msg = message
+            else:
+                formatted_msg = self.format(record)
             self._current_file.write(formatted_msg + '\n')
             self._current_file.flush()
 
@@ -231,10 +259,7 @@ class EnhancedTaskHandler(logging.Handler):
         """Close the current file."""
         if self._current_file:
             try:
-                self._current_file.write(f"\n{'='*70}\n")
-                self._current_file.write(f"Task ended: {datetime.now().isoformat()}\n")
-                self._current_file.write(f"Total requests: {self._request_count}\n")
-                self._current_file.write(f"{'='*70}\n")
+                self._write_task_footer()
                 self._current_file.close()
             except:
                 pass
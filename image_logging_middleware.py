@@ -8,13 +8,242 @@ Usage:
     Add this to VLLM's API server to capture image information.
 """
 
-import base64
+import atexit
 import io
 import logging
+import logging.handlers
+import os
+import queue
+import struct
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
-from PIL import Image
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
+
+try:
+    import pybase64 as _b64  # SIMD base64 decoder, drop-in for stdlib base64
+except ImportError:
+    import base64 as _b64
+
+# PIL is imported on first use so scripts that never decode stay light
+_Image = None
+
+
+def _pil_image():
+    """Return the PIL.Image module, importing it on first call."""
+    global _Image
+    if _Image is None:
+        from PIL import Image
+        _Image = Image
+    return _Image
+
+
+# PNG (bit depth, color type) -> PIL mode; unusual depths fall back to PIL
+_PNG_MODES = {
+    (1, 0): '1', (2, 0): 'L', (4, 0): 'L', (8, 0): 'L',
+    (8, 2): 'RGB', (16, 2): 'RGB',
+    (1, 3): 'P', (2, 3): 'P', (4, 3): 'P', (8, 3): 'P',
+    (8, 4): 'LA',
+    (8, 6): 'RGBA', (16, 6): 'RGBA',
+}
+
+# JPEG component count -> PIL mode
+_JPEG_MODES = {1: 'L', 3: 'RGB', 4: 'CMYK'}
+
+
+def _sniff_png(buf: bytes) -> Optional[Tuple[int, int, str, str]]:
+    """IHDR: width/height at 16..24, bit depth and color type at 24/25."""
+    width, height = struct.unpack_from('>II', buf, 16)
+    mode = _PNG_MODES.get((buf[24], buf[25]))
+    if mode is None:
+        return None
+    return width, height, 'PNG', mode
+
+
+def _sniff_jpeg(buf: bytes) -> Optional[Tuple[int, int, str, str]]:
+    """Walk the marker segments up to the first SOFn frame header."""
+    pos = 2
+    while pos + 4 <= len(buf):
+        if buf[pos] != 0xFF:
+            return None
+        marker = buf[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:  # standalone markers
+            pos += 2
+            continue
+        (length,) = struct.unpack_from('>H', buf, pos + 2)
+        # SOF0..SOF15, excluding DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width, components = struct.unpack_from('>HHB', buf, pos + 5)
+            mode = _JPEG_MODES.get(components)
+            if mode is None:
+                return None
+            return width, height, 'JPEG', mode
+        pos += 2 + length
+    return None
+
+
+def _sniff_webp(buf: bytes) -> Optional[Tuple[int, int, str, str]]:
+    """RIFF container: read the VP8 / VP8L / VP8X chunk header."""
+    if buf[8:12] != b'WEBP':
+        return None
+    chunk = buf[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack_from('<HH', buf, 26)
+        return width & 0x3FFF, height & 0x3FFF, 'WEBP', 'RGB'
+    if chunk == b'VP8L':
+        (bits,) = struct.unpack_from('<I', buf, 21)
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+        mode = 'RGBA' if bits & (1 << 28) else 'RGB'
+        return width, height, 'WEBP', mode
+    if chunk == b'VP8X':
+        width = int.from_bytes(buf[24:27], 'little') + 1
+        height = int.from_bytes(buf[27:30], 'little') + 1
+        mode = 'RGBA' if buf[20] & 0x10 else 'RGB'
+        return width, height, 'WEBP', mode
+    return None
+
+
+def _sniff_gif(buf: bytes) -> Optional[Tuple[int, int, str, str]]:
+    """Logical screen descriptor: width/height at 6..10."""
+    width, height = struct.unpack_from('<HH', buf, 6)
+    return width, height, 'GIF', 'P'
+
+
+def _sniff_bmp(buf: bytes) -> Optional[Tuple[int, int, str, str]]:
+    """BITMAPINFOHEADER or later; only uncompressed 24-bit maps to a mode."""
+    header_size, width, height, _, bit_count, compression = struct.unpack_from(
+        '<IiiHHI', buf, 14
+    )
+    if header_size < 40 or bit_count != 24 or compression != 0:
+        return None
+    return width, abs(height), 'BMP', 'RGB'
+
+
+def _magic(prefix: bytes) -> int:
+    return int.from_bytes(prefix, 'little')
+
+
+# Magic prefixes packed as little-endian ints. The first 8 header bytes are
+# read as one uint64 and masked down to each prefix length in turn, so format
+# detection is a handful of dict lookups instead of a chain of slice compares.
+_MAGIC_MASKS = tuple((1 << (8 * n)) - 1 for n in (8, 6, 4, 3, 2))
+_MAGIC_HANDLERS = {
+    _magic(b'\x89PNG\r\n\x1a\n'): _sniff_png,
+    _magic(b'GIF87a'): _sniff_gif,
+    _magic(b'GIF89a'): _sniff_gif,
+    _magic(b'RIFF'): _sniff_webp,
+    _magic(b'\xff\xd8\xff'): _sniff_jpeg,
+    _magic(b'BM'): _sniff_bmp,
+}
+
+
+def _sniff_dims(buf: bytes) -> Optional[Tuple[int, int, str, str]]:
+    """
+    Read (width, height, format, mode) from the image header bytes alone.
+
+    Handles PNG, JPEG, WebP, GIF and 24-bit BMP without decoding any pixel
+    data. Returns None when the format is unknown or the header is
+    truncated, in which case the caller should fall back to PIL.
+    """
+    try:
+        (magic,) = struct.unpack_from('<Q', buf)
+        for mask in _MAGIC_MASKS:
+            handler = _MAGIC_HANDLERS.get(magic & mask)
+            if handler is not None:
+                return handler(buf)
+    except (struct.error, IndexError):
+        return None
+    return None
+
+
+# Base64 chars decoded up front for header sniffing (multiple of 4 -> 384 bytes)
+_HEAD_B64_CHARS = 512
+
+
+def _decoded_size(base64_data: str, start: int = 0) -> int:
+    """Decoded byte length of base64_data[start:], computed without decoding it."""
+    return ((len(base64_data) - start) * 3) // 4 - base64_data[-2:].count('=')
+
+
+def _sniff_base64_head(base64_data: str,
+                       start: int = 0) -> Optional[Tuple[int, int, str, str]]:
+    """Decode only the first _HEAD_B64_CHARS of base64_data[start:] and sniff them."""
+    head_len = min(len(base64_data) - start, _HEAD_B64_CHARS)
+    head_len -= head_len % 4
+    return _sniff_dims(_b64.b64decode(base64_data[start:start + head_len], validate=False))
+
+
+def _image_dims_from_base64(base64_data: str,
+                            start: int = 0) -> Tuple[int, int, Optional[str], str]:
+    """
+    Get (width, height, format, mode) for the image encoded in base64_data[start:].
+
+    Only the first few hundred bytes are decoded for the header sniff; the
+    full payload is sliced out, decoded and handed to PIL only when that fails.
+    """
+    dims = _sniff_base64_head(base64_data, start)
+    if dims is None:
+        image_bytes = _b64.b64decode(base64_data[start:], validate=False)
+        img = _pil_image().open(io.BytesIO(image_bytes))
+        dims = (img.width, img.height, img.format, img.mode)
+    return dims
+
+
+def _image_metadata(base64_data: str, cheap_mode: bool = False,
+                    start: int = 0) -> Dict[str, Any]:
+    """
+    Build the metadata dict for the image encoded in base64_data[start:].
+
+    Passing start (e.g. just past a data-URI comma) avoids copying the body
+    out of the URI. In cheap mode only the header is decoded, to confirm the
+    payload is an image and read its format; width/height/mode are None and
+    the size comes from the base64 length. Payloads the header sniff does not
+    recognise raise ValueError, as a failed full decode would.
+    """
+    size_bytes = _decoded_size(base64_data, start)
+    if cheap_mode:
+        dims = _sniff_base64_head(base64_data, start)
+        if dims is None:
+            raise ValueError('unrecognised image header')
+        width = height = mode = None
+        img_format = dims[2]
+    else:
+        width, height, img_format, mode = _image_dims_from_base64(base64_data, start)
+
+    return {
+        'width': width,
+        'height': height,
+        'format': img_format,
+        'mode': mode,
+        'size_bytes': size_bytes,
+        'size_kb': round(size_bytes / 1024, 2)
+    }
+
+
+def _image_file_lines(idx: int, img: Dict[str, Any]) -> List[str]:
+    """Lines describing image number idx in a per-request log file."""
+    if img['width'] is None:
+        return [
+            f"Image {idx}:\n",
+            "  Dimensions: not measured\n",
+            f"  Format: {img['format'] or 'unknown'}\n",
+            f"  Size: {img['size_kb']} KB ({img['size_bytes']} bytes)\n",
+            "\n",
+        ]
+    return [
+        f"Image {idx}:\n",
+        f"  Dimensions: {img['width']}x{img['height']} pixels\n",
+        f"  Format: {img['format']}\n",
+        f"  Color Mode: {img['mode']}\n",
+        f"  Size: {img['size_kb']} KB ({img['size_bytes']} bytes)\n",
+        f"  Aspect Ratio: {img['width']/img['height']:.2f}:1\n",
+        "\n",
+    ]
 
 
 class ImageLoggingMiddleware:
@@ -22,24 +251,131 @@ class ImageLoggingMiddleware:
     Middleware that extracts and logs image metadata from VLLM API requests.
     """
 
-    def __init__(self, log_directory="/home/jiaheng/vllm_log/image_metadata"):
+    def __init__(self, log_directory="/home/jiaheng/vllm_log/image_metadata",
+                 dims_sample_every: int = 1):
+        """
+        Args:
+            log_directory: Directory for image_sizes.log and per-request files
+            dims_sample_every: Extract image dimensions for one request in
+                every N; the others only log sizes and the header-sniffed
+                format (1 = every request)
+        """
         self.log_directory = Path(log_directory)
         self.log_directory.mkdir(parents=True, exist_ok=True)
 
-        # Setup logger
+        self.dims_sample_every = max(1, dims_sample_every)
+        self._request_counter = 0
+
+        # Setup logger; records are buffered in memory and written to the
+        # file in batches (or immediately for errors)
         self.logger = logging.getLogger('vllm.image_metadata')
-        handler = logging.FileHandler(self.log_directory / 'image_sizes.log')
+        file_handler = logging.FileHandler(self.log_directory / 'image_sizes.log')
         formatter = logging.Formatter('%(asctime)s - %(message)s')
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
+        file_handler.setFormatter(formatter)
+        self._log_handler = logging.handlers.MemoryHandler(
+            capacity=1024, target=file_handler
+        )
+        self.logger.addHandler(self._log_handler)
         self.logger.setLevel(logging.INFO)
 
-    def extract_image_from_content(self, content_item: Dict[str, Any]) -> Optional[Dict]:
+        # Per-request files are written by a background thread so the
+        # request path only pays for a queue put
+        self._write_queue = queue.Queue()
+        self._writer = threading.Thread(
+            target=self._write_loop, name='image-metadata-writer', daemon=True
+        )
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _write_loop(self):
+        """Drain queued (path, time_ns, head, body) writes in batches until close()."""
+        while True:
+            batch = [self._write_queue.get()]
+            while True:
+                try:
+                    batch.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in batch:
+                try:
+                    if item is None:
+                        return
+                    path, now_ns, head, body = item
+                    # The timestamp is only formatted here, off the request path
+                    seconds, nanos = divmod(now_ns, 1_000_000_000)
+                    timestamp = datetime.fromtimestamp(seconds).replace(microsecond=nanos // 1000)
+                    with open(path, 'w') as f:
+                        f.write(f"{head}Timestamp: {timestamp.isoformat(timespec='microseconds')}\n{body}")
+                except OSError as e:
+                    self.logger.error(f"Error writing {path}: {e}")
+                finally:
+                    self._write_queue.task_done()
+
+    def rotate_request_logs(self, archive_date: Optional[datetime] = None) -> int:
+        """
+        Move the per-request image files into one daily archive file.
+
+        Files are appended to request_images_YYYYMMDD.txt in name order and
+        then deleted. The copy uses os.sendfile where available, so the data
+        never passes through a userspace buffer.
+
+        Returns:
+            Number of per-request files archived
+        """
+        # Let queued per-request files land on disk first
+        self._write_queue.join()
+
+        archive_date = archive_date or datetime.now()
+        archive_file = self.log_directory / f"request_images_{archive_date:%Y%m%d}.txt"
+        request_files = sorted(self.log_directory.glob('request_*_images.txt'))
+        if not request_files:
+            return 0
+
+        # No O_APPEND: Linux sendfile() rejects append-mode output fds
+        dst_fd = os.open(archive_file, os.O_WRONLY | os.O_CREAT | getattr(os, 'O_CLOEXEC', 0), 0o644)
+        try:
+            os.lseek(dst_fd, 0, os.SEEK_END)
+            for request_file in request_files:
+                src_fd = os.open(request_file, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+                try:
+                    size = os.fstat(src_fd).st_size
+                    if hasattr(os, 'sendfile'):
+                        offset = 0
+                        while offset < size:
+                            sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+                            if sent == 0:
+                                break
+                            offset += sent
+                    else:
+                        while True:
+                            chunk = os.read(src_fd, 1 << 16)
+                            if not chunk:
+                                break
+                            os.write(dst_fd, chunk)
+                finally:
+                    os.close(src_fd)
+                request_file.unlink()
+        finally:
+            os.close(dst_fd)
+
+        return len(request_files)
+
+    def close(self):
+        """Flush pending per-request files and buffered log records."""
+        if self._writer.is_alive():
+            self._write_queue.put(None)
+            self._writer.join()
+        self._log_handler.flush()
+
+    def extract_image_from_content(self, content_item: Dict[str, Any],
+                                   cheap_mode: bool = False) -> Optional[Dict]:
         """
         Extract image from a content item in OpenAI format.
 
         Args:
             content_item: Dict with 'type' and 'image_url' or 'image'
+            cheap_mode: Only sniff the header for the format; skip dimensions
 
         Returns:
             Dict with image metadata or None
@@ -51,40 +387,21 @@ class ImageLoggingMiddleware:
 
                 # Handle base64 data URI
                 if url.startswith('data:image'):
-                    # Extract base64 data
-                    if ',' in url:
-                        header, base64_data = url.split(',', 1)
-                        image_format = header.split('/')[1].split(';')[0]
-
-                        # Decode and get dimensions
-                        image_bytes = base64.b64decode(base64_data)
-                        img = Image.open(io.BytesIO(image_bytes))
-
-                        return {
-                            'width': img.width,
-                            'height': img.height,
-                            'format': img.format or image_format.upper(),
-                            'mode': img.mode,
-                            'size_bytes': len(image_bytes),
-                            'size_kb': round(len(image_bytes) / 1024, 2)
-                        }
+                    # Locate the base64 data without copying it out of the URI
+                    comma = url.find(',')
+                    if comma != -1:
+                        image_format = url[:comma].split('/')[1].split(';')[0]
+
+                        metadata = _image_metadata(url, cheap_mode, start=comma + 1)
+                        metadata['format'] = metadata['format'] or image_format.upper()
+                        return metadata
 
             elif content_item.get('type') == 'image':
                 # Direct image data
                 image_data = content_item.get('image')
                 if isinstance(image_data, str):
                     # Base64 string
-                    image_bytes = base64.b64decode(image_data)
-                    img = Image.open(io.BytesIO(image_bytes))
-
-                    return {
-                        'width': img.width,
-                        'height': img.height,
-                        'format': img.format,
-                        'mode': img.mode,
-                        'size_bytes': len(image_bytes),
-                        'size_kb': round(len(image_bytes) / 1024, 2)
-                    }
+                    return _image_metadata(image_data, cheap_mode)
 
         except Exception as e:
             self.logger.error(f"Error extracting image: {e}")
@@ -101,8 +418,14 @@ class ImageLoggingMiddleware:
         """
         images = []
 
+        # Only every Nth request pays for dimension extraction
+        cheap_mode = self._request_counter % self.dims_sample_every != 0
+        self._request_counter += 1
+
         # Check OpenAI chat completion format
         if 'messages' in request_data:
+            # Images are sniffed inline: each costs a 512-char header
+            # decode, far less than handing it to a worker thread
             for message in request_data['messages']:
                 content = message.get('content', [])
 
@@ -110,7 +433,7 @@ class ImageLoggingMiddleware:
                 if isinstance(content, list):
                     for item in content:
                         if isinstance(item, dict):
-                            img_metadata = self.extract_image_from_content(item)
+                            img_metadata = self.extract_image_from_content(item, cheap_mode)
                             if img_metadata:
                                 images.append(img_metadata)
 
@@ -128,27 +451,27 @@ class ImageLoggingMiddleware:
         if images:
             self.logger.info(f"Request {request_id}: {len(images)} image(s)")
             for idx, img in enumerate(images, 1):
+                if img['width'] is None:
+                    self.logger.info(
+                        f"  Image {idx}: dimensions not sampled "
+                        f"{img['format'] or 'unknown'} ({img['size_kb']} KB)"
+                    )
+                    continue
                 self.logger.info(
                     f"  Image {idx}: {img['width']}x{img['height']} "
                     f"{img['format']} {img['mode']} "
                     f"({img['size_kb']} KB)"
                 )
 
-            # Also write to per-request file
+            # Also write to per-request file (in the background)
+            now_ns = time.time_ns()
             request_file = self.log_directory / f"request_{request_id}_images.txt"
-            with open(request_file, 'w') as f:
-                f.write(f"Request ID: {request_id}\n")
-                f.write(f"Timestamp: {datetime.now().isoformat()}\n")
-                f.write(f"Total Images: {len(images)}\n\n")
-
-                for idx, img in enumerate(images, 1):
-                    f.write(f"Image {idx}:\n")
-                    f.write(f"  Dimensions: {img['width']}x{img['height']} pixels\n")
-                    f.write(f"  Format: {img['format']}\n")
-                    f.write(f"  Color Mode: {img['mode']}\n")
-                    f.write(f"  Size: {img['size_kb']} KB ({img['size_bytes']} bytes)\n")
-                    f.write(f"  Aspect Ratio: {img['width']/img['height']:.2f}:1\n")
-                    f.write("\n")
+            lines = [f"Total Images: {len(images)}\n\n"]
+            for idx, img in enumerate(images, 1):
+                lines.extend(_image_file_lines(idx, img))
+            self._write_queue.put(
+                (request_file, now_ns, f"Request ID: {request_id}\n", ''.join(lines))
+            )
 
         return len(images)
 
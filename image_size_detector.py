@@ -8,10 +8,66 @@ This script can:
 """
 
 import re
-import base64
 import io
+import mmap
+from bisect import bisect_left
+from contextlib import contextmanager
 from pathlib import Path
-from PIL import Image
+
+try:
+    import pybase64 as _b64  # SIMD base64 decoder, drop-in for stdlib base64
+except ImportError:
+    import base64 as _b64
+
+# PIL is imported on first use so scripts that never decode stay light
+_Image = None
+
+
+def _pil_image():
+    """Return the PIL.Image module, importing it on first call."""
+    global _Image
+    if _Image is None:
+        from PIL import Image
+        _Image = Image
+    return _Image
+
+
+# Log-scan patterns, compiled once at import; they run on the mmap'd bytes
+_BASE64_RE = re.compile(
+    rb'data:image/(png|jpeg|jpg|gif|webp);base64,([A-Za-z0-9+/]{100,}={0,2})',
+    re.IGNORECASE
+)
+# The prompt capture is _PROMPT_HEAD_CHARS characters; in UTF-8 that is up
+# to 4 bytes each, so capture enough bytes and trim after decoding
+_PROMPT_HEAD_CHARS = 500
+_REQUEST_RE = re.compile(
+    rb'Received request (chatcmpl-[a-f0-9]+): prompt: \'(.{0,%d})' % (4 * _PROMPT_HEAD_CHARS),
+    re.IGNORECASE
+)
+_PARAMS_MARKER = b', params: SamplingParams'
+_PARAMS_RE = re.compile(re.escape(_PARAMS_MARKER))
+
+# Case-insensitive indicator checks, run directly on the mapped prompt span
+_SCREENSHOT_RE = re.compile(rb'screenshot', re.IGNORECASE)
+_BROWSER_VISION_RE = re.compile(rb'browser_vision', re.IGNORECASE)
+
+# How far past "Received request" to look for the end of the prompt, in
+# characters (the log is UTF-8, so that can be up to 4x as many bytes)
+_PROMPT_WINDOW = 100000
+
+
+@contextmanager
+def _mapped_log(log_file):
+    """
+    Map a log file read-only so it can be scanned without loading it into
+    a Python str. Yields b'' for an empty file (mmap cannot map 0 bytes).
+    """
+    with open(log_file, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield mm
 
 
 def estimate_image_size_from_base64(base64_string):
@@ -26,13 +82,13 @@ def estimate_image_size_from_base64(base64_string):
             base64_string = base64_string.split(',', 1)[1]
 
         # Decode base64
-        image_data = base64.b64decode(base64_string)
+        image_data = _b64.b64decode(base64_string, validate=False)
 
         # Get size in KB
         size_kb = len(image_data) / 1024
 
         # Try to open as image
-        img = Image.open(io.BytesIO(image_data))
+        img = _pil_image().open(io.BytesIO(image_data))
         width, height = img.size
         img_format = img.format
 
@@ -55,26 +111,17 @@ def search_for_base64_images_in_logs(log_file):
     """
     print("Searching for base64 image data in logs...")
 
-    with open(log_file, 'r', errors='ignore') as f:
-        content = f.read()
-
-    # Pattern for base64 image data
-    base64_pattern = re.compile(
-        r'data:image/(png|jpeg|jpg|gif|webp);base64,([A-Za-z0-9+/]{100,}={0,2})',
-        re.IGNORECASE
-    )
-
-    matches = base64_pattern.finditer(content)
     images_found = []
 
-    for match in matches:
-        image_format = match.group(1)
-        base64_data = match.group(2)
+    with _mapped_log(log_file) as mm:
+        for match in _BASE64_RE.finditer(mm):
+            image_format = match.group(1).decode('ascii')
+            base64_data = match.group(2).decode('ascii')
 
-        # Try to decode and get dimensions
-        result = estimate_image_size_from_base64(base64_data)
-        if 'error' not in result:
-            images_found.append(result)
+            # Try to decode and get dimensions
+            result = estimate_image_size_from_base64(base64_data)
+            if 'error' not in result:
+                images_found.append(result)
 
     return images_found
 
@@ -109,48 +156,54 @@ def analyze_requests_for_image_sizes(log_file):
     print("VLLM Image Size Analysis")
     print("="*70 + "\n")
 
-    with open(log_file, 'r', errors='ignore') as f:
-        content = f.read()
-
-    # Find all "Received request" entries
-    request_pattern = re.compile(
-        r'Received request (chatcmpl-[a-f0-9]+): prompt: \'(.{0,500})',
-        re.IGNORECASE
-    )
-
     requests = []
 
-    for match in request_pattern.finditer(content):
-        request_id = match.group(1)
-        prompt_start = match.group(2)
-
-        # Try to find the full prompt for this request
-        # Look for "params: SamplingParams" which marks the end
-        start_pos = match.start()
-        end_match = re.search(r', params: SamplingParams', content[start_pos:start_pos+100000])
-
-        if end_match:
-            full_prompt = content[start_pos:start_pos+end_match.start()]
-            prompt_length = len(full_prompt)
-        else:
-            prompt_length = len(prompt_start)
-
-        # Check for image indicators
-        has_screenshot = 'screenshot' in full_prompt.lower() if end_match else False
-        has_image_tag = '<image>' in full_prompt if end_match else False
-        has_browser_vision = 'browser_vision' in full_prompt.lower() if end_match else False
-
-        # Estimate image characteristics
-        estimate = estimate_from_prompt_length(prompt_length)
-
-        requests.append({
-            'request_id': request_id,
-            'prompt_length': prompt_length,
-            'has_screenshot': has_screenshot,
-            'has_image_tag': has_image_tag,
-            'has_browser_vision': has_browser_vision,
-            'estimate': estimate
-        })
+    with _mapped_log(log_file) as mm:
+        # Every "params: SamplingParams" marks the end of a prompt; find them
+        # all in one pass and bisect per request instead of re-searching
+        param_positions = [m.start() for m in _PARAMS_RE.finditer(mm)]
+
+        # Find all "Received request" entries
+        for match in _REQUEST_RE.finditer(mm):
+            request_id = match.group(1).decode('ascii')
+            prompt_start = match.group(2)
+
+            # Try to find the full prompt for this request: the next
+            # "params: SamplingParams" within the search window. Positions
+            # are byte offsets, but lengths and the window are counted in
+            # characters, so only the prompt span itself is decoded.
+            start_pos = match.start()
+            idx = bisect_left(param_positions, start_pos)
+            end_match = False
+            if idx < len(param_positions):
+                end_pos = param_positions[idx]
+                if end_pos + len(_PARAMS_MARKER) - start_pos <= 4 * _PROMPT_WINDOW:
+                    prompt_length = len(mm[start_pos:end_pos].decode('utf-8', errors='ignore'))
+                    end_match = prompt_length + len(_PARAMS_MARKER) <= _PROMPT_WINDOW
+
+            # Check for image indicators over [start_pos, end_pos) of the
+            # mapping itself, without copying or lowercasing the prompt
+            if end_match:
+                has_screenshot = _SCREENSHOT_RE.search(mm, start_pos, end_pos) is not None
+                has_image_tag = mm.find(b'<image>', start_pos, end_pos) != -1
+                has_browser_vision = _BROWSER_VISION_RE.search(mm, start_pos, end_pos) is not None
+            else:
+                prompt_length = len(
+                    prompt_start.decode('utf-8', errors='ignore')[:_PROMPT_HEAD_CHARS]
+                )
+                has_screenshot = has_image_tag = has_browser_vision = False
+
+            # Estimate image characteristics
+            estimate = estimate_from_prompt_length(prompt_length)
+
+            requests.append({
+                'request_id': request_id,
+                'prompt_length': prompt_length,
+                'has_screenshot': has_screenshot,
+                'has_image_tag': has_image_tag,
+                'has_browser_vision': has_browser_vision,
+                'estimate': estimate
+            })
 
     return requests
 
@@ -6,14 +6,161 @@ Queries the Prometheus metrics endpoint and logs prefill/decode times to files.
 Can be run standalone or integrated with existing logging.
 """
 
+import sys
 import time
-import requests
 import json
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Optional, Tuple
 import re
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # Optional Cython build of the scrape parser (see _metrics_parse.pyx)
+    from _metrics_parse import parse_wanted_samples as _parse_wanted_samples_c
+except ImportError:
+    _parse_wanted_samples_c = None
+
+# Histograms summarized by extract_key_metrics: result key -> metric name
+_HISTOGRAMS = (
+    ('ttft', 'vllm:time_to_first_token_seconds'),                 # prefill time
+    ('tpot', 'vllm:time_per_output_token_seconds'),               # decode time per token
+    ('inter_token_latency', 'vllm:inter_token_latency_seconds'),
+    ('e2e_latency', 'vllm:e2e_request_latency_seconds'),
+    ('prefill_time', 'vllm:request_prefill_time_seconds'),
+    ('decode_time', 'vllm:request_decode_time_seconds'),
+)
+
+# Prometheus sample name -> (result key, field) for the single-pass parser.
+# Scrapes are ASCII and parsed as bytes, so the names are bytes too.
+_WANTED_SAMPLES: Dict[bytes, Tuple[str, str]] = {}
+for _key, _name in _HISTOGRAMS:
+    _WANTED_SAMPLES[f'{_name}_count'.encode()] = (_key, 'count')
+    _WANTED_SAMPLES[f'{_name}_sum'.encode()] = (_key, 'sum')
+_WANTED_SAMPLES[b'vllm:prompt_tokens_total'] = ('tokens', 'prompt_total')
+_WANTED_SAMPLES[b'vllm:generation_tokens_total'] = ('tokens', 'generated_total')
+_SUCCESS_SAMPLE = b'vllm:request_success_total'
+
+
+def _parse_wanted_samples(metrics_text: bytes) -> Dict[Tuple[str, str], float]:
+    """
+    Collect the samples extract_key_metrics needs in one pass over the text.
+
+    Uses the compiled parser when _metrics_parse has been built.
+    """
+    if _parse_wanted_samples_c is not None:
+        return _parse_wanted_samples_c(metrics_text, _WANTED_SAMPLES, _SUCCESS_SAMPLE)
+    return _parse_wanted_samples_py(metrics_text)
+
+
+def _parse_wanted_samples_py(metrics_text: bytes) -> Dict[Tuple[str, str], float]:
+    """
+    Pure-Python single-pass parser for the samples extract_key_metrics needs.
+
+    Only labelled samples ('name{labels} value') are considered, and the first
+    sample seen for each name wins, as with a plain re.search.
+    """
+    values = {}
+    for line in metrics_text.splitlines():
+        if not line or line.startswith(b'#'):
+            continue
+        name, brace, rest = line.partition(b'{')
+        if not brace:
+            continue
+        key = _WANTED_SAMPLES.get(name)
+        if key is None and name != _SUCCESS_SAMPLE:
+            continue
+        labels, sep, value = rest.partition(b'} ')
+        if not sep:
+            continue
+        if key is None:
+            if b'finished_reason="stop"' not in labels:
+                continue
+            key = ('requests_completed', '')
+        if key not in values:
+            values[key] = float(value.split(b' ', 1)[0])
+    return values
+
+
+# Report layout is fixed, so it is kept as format_map templates filled from
+# flat dicts each tick rather than rebuilt line by line
+_RULE = "=" * 70
+_SUBRULE = "-" * 70
+
+_REPORT_TEMPLATE = "\n".join([
+    _RULE,
+    "vLLM Metrics Report - {now}",
+    _RULE,
+    "",
+    "OVERALL STATISTICS",
+    _SUBRULE,
+    "Total Requests Completed: {completed}",
+    "Total Prompt Tokens: {prompt_total}",
+    "Total Generated Tokens: {generated_total}",
+    "",
+    "TIMING METRICS (All Requests)",
+    _SUBRULE,
+    "Prefill Time (TTFT):",
+    "  Average: {ttft_avg:.3f}s",
+    "  Total: {ttft_sum:.3f}s",
+    "  Count: {ttft_count}",
+    "",
+    "Decode Time per Request:",
+    "  Average: {decode_avg:.3f}s",
+    "  Total: {decode_sum:.3f}s",
+    "  Count: {decode_count}",
+    "",
+    "Time per Output Token:",
+    "  Average: {tpot_avg:.3f}s",
+    "",
+    "End-to-End Latency:",
+    "  Average: {e2e_avg:.3f}s",
+    "",
+    "",
+])
+
+_DELTA_TEMPLATE = "\n".join([
+    _RULE,
+    "NEW REQUESTS SINCE LAST CHECK: {new_requests}",
+    _SUBRULE,
+    "Prefill Time (TTFT): {ttft_avg:.3f}s avg",
+    "Decode Time: {decode_avg:.3f}s avg",
+    "E2E Latency: {e2e_avg:.3f}s avg",
+    "Prompt Tokens: {prompt}",
+    "Generated Tokens: {generated}",
+    "",
+    "",
+])
+
+# Histogram name -> (count pattern, sum pattern), filled on first use
+_HIST_RE_CACHE: Dict[str, Tuple[re.Pattern, re.Pattern]] = {}
+
+
+def _get_hist_patterns(metric_name: str) -> Tuple[re.Pattern, re.Pattern]:
+    """Return the memoized bytes (count, sum) patterns for a histogram metric."""
+    patterns = _HIST_RE_CACHE.get(metric_name)
+    if patterns is None:
+        name = re.escape(metric_name.encode())
+        patterns = (
+            re.compile(rb'%s_count{[^}]*} (\S+)' % name),
+            re.compile(rb'%s_sum{[^}]*} (\S+)' % name),
+        )
+        _HIST_RE_CACHE[metric_name] = patterns
+    return patterns
+
+
+def _dump_json(data, indent: bool = True) -> bytes:
+    """Serialize to JSON bytes (indented or compact), via orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(data, indent=2).encode('utf-8')
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
 
 class VLLMMetricsLogger:
     """
@@ -37,27 +184,41 @@ class VLLMMetricsLogger:
         # Track previous values to compute deltas
         self.prev_metrics = {}
 
-    def fetch_metrics(self) -> Optional[str]:
-        """Fetch metrics from Prometheus endpoint."""
+        # Long-lived append files, only open during monitor_continuous()
+        self._report_fh = None
+        self._json_fh = None
+
+        # Reuse one keep-alive connection across scrapes (requests is
+        # imported here so --help and parsing-only use skip it)
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._session = requests.Session()
+        self._session.headers['Accept-Encoding'] = 'gzip'
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def fetch_metrics(self) -> Optional[bytes]:
+        """Fetch metrics from Prometheus endpoint as raw (ASCII) bytes."""
         try:
-            response = requests.get(self.metrics_url, timeout=5)
+            response = self._session.get(self.metrics_url, timeout=5)
             response.raise_for_status()
-            return response.text
+            return response.content
         except Exception as e:
             print(f"Error fetching metrics: {e}")
             return None
 
-    def parse_histogram_summary(self, metrics_text: str, metric_name: str) -> Dict:
+    def parse_histogram_summary(self, metrics_text: bytes, metric_name: str) -> Dict:
         """
         Parse histogram metrics to get count and sum.
 
         Returns dict with 'count' and 'sum' (total time).
         """
-        count_pattern = f'{metric_name}_count{{[^}}]*}} (\\S+)'
-        sum_pattern = f'{metric_name}_sum{{[^}}]*}} (\\S+)'
+        count_re, sum_re = _get_hist_patterns(metric_name)
 
-        count_match = re.search(count_pattern, metrics_text)
-        sum_match = re.search(sum_pattern, metrics_text)
+        count_match = count_re.search(metrics_text)
+        sum_match = sum_re.search(metrics_text)
 
         count = float(count_match.group(1)) if count_match else 0
         total = float(sum_match.group(1)) if sum_match else 0
@@ -70,52 +231,29 @@ class VLLMMetricsLogger:
             'average': avg
         }
 
-    def extract_key_metrics(self, metrics_text: str) -> Dict:
+    def extract_key_metrics(self, metrics_text: bytes) -> Dict:
         """Extract key timing metrics from Prometheus response."""
+        values = _parse_wanted_samples(metrics_text)
         metrics = {}
 
-        # Time to first token (prefill time)
-        metrics['ttft'] = self.parse_histogram_summary(
-            metrics_text, 'vllm:time_to_first_token_seconds'
-        )
-
-        # Time per output token (decode time per token)
-        metrics['tpot'] = self.parse_histogram_summary(
-            metrics_text, 'vllm:time_per_output_token_seconds'
-        )
-
-        # Inter-token latency
-        metrics['inter_token_latency'] = self.parse_histogram_summary(
-            metrics_text, 'vllm:inter_token_latency_seconds'
-        )
-
-        # E2E request latency
-        metrics['e2e_latency'] = self.parse_histogram_summary(
-            metrics_text, 'vllm:e2e_request_latency_seconds'
-        )
-
-        # Prefill time per request
-        metrics['prefill_time'] = self.parse_histogram_summary(
-            metrics_text, 'vllm:request_prefill_time_seconds'
-        )
-
-        # Decode time per request
-        metrics['decode_time'] = self.parse_histogram_summary(
-            metrics_text, 'vllm:request_decode_time_seconds'
-        )
+        # Histogram summaries (TTFT, TPOT, latencies, prefill/decode time)
+        for key, _ in _HISTOGRAMS:
+            count = values.get((key, 'count'), 0)
+            total = values.get((key, 'sum'), 0)
+            metrics[key] = {
+                'count': count,
+                'sum': total,
+                'average': total / count if count > 0 else 0
+            }
 
         # Token counts
-        prompt_tokens_match = re.search(r'vllm:prompt_tokens_total{[^}]*} (\S+)', metrics_text)
-        gen_tokens_match = re.search(r'vllm:generation_tokens_total{[^}]*} (\S+)', metrics_text)
-
         metrics['tokens'] = {
-            'prompt_total': float(prompt_tokens_match.group(1)) if prompt_tokens_match else 0,
-            'generated_total': float(gen_tokens_match.group(1)) if gen_tokens_match else 0
+            'prompt_total': values.get(('tokens', 'prompt_total'), 0),
+            'generated_total': values.get(('tokens', 'generated_total'), 0)
         }
 
         # Request success count
-        success_match = re.search(r'vllm:request_success_total{[^}]*finished_reason="stop"[^}]*} (\S+)', metrics_text)
-        metrics['requests_completed'] = float(success_match.group(1)) if success_match else 0
+        metrics['requests_completed'] = values.get(('requests_completed', ''), 0)
 
         return metrics
 
@@ -152,59 +290,34 @@ class VLLMMetricsLogger:
         return deltas
 
     def format_metrics_report(self, metrics: Dict, deltas: Optional[Dict] = None) -> str:
-        """Format metrics into human-readable report."""
-        lines = []
-        lines.append("=" * 70)
-        lines.append(f"vLLM Metrics Report - {datetime.now().isoformat()}")
-        lines.append("=" * 70)
-        lines.append("")
-
-        # Overall statistics
-        lines.append("OVERALL STATISTICS")
-        lines.append("-" * 70)
-        lines.append(f"Total Requests Completed: {int(metrics['requests_completed'])}")
-        lines.append(f"Total Prompt Tokens: {int(metrics['tokens']['prompt_total'])}")
-        lines.append(f"Total Generated Tokens: {int(metrics['tokens']['generated_total'])}")
-        lines.append("")
-
-        # Timing metrics
-        lines.append("TIMING METRICS (All Requests)")
-        lines.append("-" * 70)
-        lines.append(f"Prefill Time (TTFT):")
-        lines.append(f"  Average: {metrics['ttft']['average']:.3f}s")
-        lines.append(f"  Total: {metrics['ttft']['sum']:.3f}s")
-        lines.append(f"  Count: {int(metrics['ttft']['count'])}")
-        lines.append("")
-
-        lines.append(f"Decode Time per Request:")
-        lines.append(f"  Average: {metrics['decode_time']['average']:.3f}s")
-        lines.append(f"  Total: {metrics['decode_time']['sum']:.3f}s")
-        lines.append(f"  Count: {int(metrics['decode_time']['count'])}")
-        lines.append("")
-
-        lines.append(f"Time per Output Token:")
-        lines.append(f"  Average: {metrics['tpot']['average']:.3f}s")
-        lines.append("")
-
-        lines.append(f"End-to-End Latency:")
-        lines.append(f"  Average: {metrics['e2e_latency']['average']:.3f}s")
-        lines.append("")
+        """Format metrics into a human-readable report (newline-terminated)."""
+        report = _REPORT_TEMPLATE.format_map({
+            'now': datetime.now().isoformat(),
+            'completed': int(metrics['requests_completed']),
+            'prompt_total': int(metrics['tokens']['prompt_total']),
+            'generated_total': int(metrics['tokens']['generated_total']),
+            'ttft_avg': metrics['ttft']['average'],
+            'ttft_sum': metrics['ttft']['sum'],
+            'ttft_count': int(metrics['ttft']['count']),
+            'decode_avg': metrics['decode_time']['average'],
+            'decode_sum': metrics['decode_time']['sum'],
+            'decode_count': int(metrics['decode_time']['count']),
+            'tpot_avg': metrics['tpot']['average'],
+            'e2e_avg': metrics['e2e_latency']['average'],
+        })
 
         # Delta metrics (new requests since last check)
         if deltas and deltas.get('new_requests', 0) > 0:
-            lines.append("=" * 70)
-            lines.append(f"NEW REQUESTS SINCE LAST CHECK: {int(deltas['new_requests'])}")
-            lines.append("-" * 70)
-            lines.append(f"Prefill Time (TTFT): {deltas['ttft']['average']:.3f}s avg")
-            lines.append(f"Decode Time: {deltas['decode_time']['average']:.3f}s avg")
-            lines.append(f"E2E Latency: {deltas['e2e_latency']['average']:.3f}s avg")
-            lines.append(f"Prompt Tokens: {int(deltas['tokens']['prompt'])}")
-            lines.append(f"Generated Tokens: {int(deltas['tokens']['generated'])}")
-            lines.append("")
+            report += _DELTA_TEMPLATE.format_map({
+                'new_requests': int(deltas['new_requests']),
+                'ttft_avg': deltas['ttft']['average'],
+                'decode_avg': deltas['decode_time']['average'],
+                'e2e_avg': deltas['e2e_latency']['average'],
+                'prompt': int(deltas['tokens']['prompt']),
+                'generated': int(deltas['tokens']['generated']),
+            })
 
-        lines.append("=" * 70)
-
-        return "\n".join(lines)
+        return report + _RULE + '\n'
 
     def log_current_metrics(self) -> None:
         """Fetch and log current metrics."""
@@ -218,22 +331,33 @@ class VLLMMetricsLogger:
         # Generate report
         report = self.format_metrics_report(current, deltas)
 
-        # Print to console
-        print(report)
-
-        # Save to file
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        report_file = self.log_dir / f"metrics_{timestamp}.txt"
-        report_file.write_text(report)
+        # Print to console (the report file below is the record otherwise)
+        if sys.stdout.isatty():
+            print(report, end='')
 
-        # Save JSON for programmatic access
-        json_file = self.log_dir / f"metrics_{timestamp}.json"
         json_data = {
             'timestamp': datetime.now().isoformat(),
             'current': current,
             'deltas': deltas
         }
-        json_file.write_text(json.dumps(json_data, indent=2))
+
+        if self._report_fh is not None:
+            # Continuous mode: append to the files opened once by
+            # monitor_continuous() instead of creating two files per tick
+            self._report_fh.write(report + '---\n')
+            self._report_fh.flush()
+            self._json_fh.write(_dump_json(json_data, indent=False) + b'\n')
+            self._json_fh.flush()
+            report_file = Path(self._report_fh.name)
+        else:
+            # Save to file
+            timestamp = time.strftime("%Y%m%d_%H%M%S")
+            report_file = self.log_dir / f"metrics_{timestamp}.txt"
+            report_file.write_text(report)
+
+            # Save JSON for programmatic access
+            json_file = self.log_dir / f"metrics_{timestamp}.json"
+            json_file.write_bytes(_dump_json(json_data))
 
         # Update previous metrics
         self.prev_metrics = current
@@ -241,17 +365,28 @@ class VLLMMetricsLogger:
         print(f"\nMetrics saved to: {report_file}")
 
     def monitor_continuous(self, interval_seconds: int = 60):
-        """Continuously monitor and log metrics."""
+        """
+        Continuously monitor and log metrics.
+
+        Reports are appended to metrics.log (separated by '---') and JSON
+        snapshots to metrics.jsonl (one object per line), both opened once.
+        """
         print(f"Starting continuous monitoring (interval: {interval_seconds}s)")
         print(f"Logs will be saved to: {self.log_dir}")
         print("Press Ctrl+C to stop\n")
 
+        self._report_fh = (self.log_dir / 'metrics.log').open('a')
+        self._json_fh = (self.log_dir / 'metrics.jsonl').open('ab')
         try:
             while True:
                 self.log_current_metrics()
                 time.sleep(interval_seconds)
         except KeyboardInterrupt:
             print("\n\nMonitoring stopped.")
+        finally:
+            self._report_fh.close()
+            self._json_fh.close()
+            self._report_fh = self._json_fh = None
 
 
 def main():
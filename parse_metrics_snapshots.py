@@ -6,40 +6,67 @@ This script reads the metrics snapshot files saved before/after each request
 and calculates the exact timing for each request.
 """
 
-import re
+import mmap
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
 
+# Prometheus sample name -> result key for the single-pass line parser.
+# Snapshots are scanned as bytes straight off an mmap, so names are bytes.
+_WANTED_SAMPLES = {
+    b'vllm:request_prefill_time_seconds_sum': 'prefill_sum',
+    b'vllm:request_prefill_time_seconds_count': 'prefill_count',
+    b'vllm:request_decode_time_seconds_sum': 'decode_sum',
+    b'vllm:request_decode_time_seconds_count': 'decode_count',
+    # TTFT (time to first token)
+    b'vllm:time_to_first_token_seconds_sum': 'ttft_sum',
+    b'vllm:time_to_first_token_seconds_count': 'ttft_count',
+}
+
+
+def _scan_samples(lines):
+    """
+    Collect the wanted sample values from an iterable of byte lines.
+
+    Only labelled samples ('name{labels} value') count, and the first sample
+    per name wins.
+    """
+    values = {}
+    for line in lines:
+        if line.startswith(b'#'):
+            continue
+        name, brace, rest = line.partition(b'{')
+        key = _WANTED_SAMPLES.get(name) if brace else None
+        if key is None or key in values:
+            continue
+        labels, sep, value = rest.partition(b'} ')
+        if sep:
+            values[key] = float(value.split(b' ', 1)[0])
+    return values
+
+
 def parse_metrics_file(filepath):
     """Parse a Prometheus metrics file and extract vLLM timing metrics."""
     try:
-        with open(filepath, 'r') as f:
-            text = f.read()
+        # Map the file and read lines off the mapping rather than decoding
+        # the whole snapshot into a str (mmap cannot map an empty file)
+        with open(filepath, 'rb') as f:
+            if f.seek(0, 2) == 0:
+                values = {}
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    values = _scan_samples(iter(mm.readline, b''))
 
+        # Only report a metric when both its sum and count were found
         metrics = {}
-
-        # Prefill time
-        prefill_sum = re.search(r'vllm:request_prefill_time_seconds_sum{[^}]*} (\S+)', text)
-        prefill_count = re.search(r'vllm:request_prefill_time_seconds_count{[^}]*} (\S+)', text)
-        if prefill_sum and prefill_count:
-            metrics['prefill_sum'] = float(prefill_sum.group(1))
-            metrics['prefill_count'] = float(prefill_count.group(1))
-
-        # Decode time
-        decode_sum = re.search(r'vllm:request_decode_time_seconds_sum{[^}]*} (\S+)', text)
-        decode_count = re.search(r'vllm:request_decode_time_seconds_count{[^}]*} (\S+)', text)
-        if decode_sum and decode_count:
-            metrics['decode_sum'] = float(decode_sum.group(1))
-            metrics['decode_count'] = float(decode_count.group(1))
-
-        # TTFT (time to first token)
-        ttft_sum = re.search(r'vllm:time_to_first_token_seconds_sum{[^}]*} (\S+)', text)
-        ttft_count = re.search(r'vllm:time_to_first_token_seconds_count{[^}]*} (\S+)', text)
-        if ttft_sum and ttft_count:
-            metrics['ttft_sum'] = float(ttft_sum.group(1))
-            metrics['ttft_count'] = float(ttft_count.group(1))
+        for prefix in ('prefill', 'decode', 'ttft'):
+            sum_key, count_key = f'{prefix}_sum', f'{prefix}_count'
+            if sum_key in values and count_key in values:
+                metrics[sum_key] = values[sum_key]
+                metrics[count_key] = values[count_key]
 
         return metrics
     except Exception as e:
@@ -54,69 +81,72 @@ def find_request_pairs(snapshots_dir):
     # Group files by request_id
     requests = {}
 
-    for filepath in snapshots_dir.glob("*.txt"):
-        filename = filepath.name
-        # Parse filename: {request_id}_{stage}_{timestamp}.txt
-        parts = filename.replace('.txt', '').split('_')
-
-        if len(parts) >= 3:
-            # Request ID is everything before the second-to-last underscore
-            # Stage is second-to-last part (before/after)
-            # Timestamp is last part
-
-            # Find the stage (before/after)
-            if 'before' in filename:
-                stage = 'before'
-                stage_idx = filename.index('_before_')
-                request_id = filename[:stage_idx]
-            elif 'after' in filename:
-                stage = 'after'
-                stage_idx = filename.index('_after_')
-                request_id = filename[:stage_idx]
-            else:
+    with os.scandir(snapshots_dir) as entries:
+        for entry in entries:
+            filename = entry.name
+            if not filename.endswith('.txt'):
+                continue
+
+            # Parse filename: {request_id}_{stage}_{timestamp}.txt, where the
+            # timestamp is YYYYMMDD_HHMMSS_ffffff and the request ID may
+            # itself contain underscores
+            parts = filename[:-4].rsplit('_', 4)
+            if len(parts) != 5:
+                continue
+            request_id, stage = parts[0], parts[1]
+            if stage not in ('before', 'after'):
                 continue
 
             if request_id not in requests:
                 requests[request_id] = {}
 
-            requests[request_id][stage] = filepath
+            requests[request_id][stage] = snapshots_dir / filename
 
     return requests
 
 
-def calculate_request_metrics(request_id, before_file, after_file):
-    """Calculate timing metrics for a request from before/after snapshots."""
-    print(f"\n{'='*70}")
-    print(f"Request: {request_id}")
-    print(f"{'='*70}")
+def _request_report(request_id, before_file, after_file):
+    """
+    Build the report text and metrics for one request without printing.
+
+    Returns (report, result), where result is None if a snapshot could not
+    be parsed. Kept at module level so worker processes can run it.
+    """
+    parts = [
+        f"\n{'='*70}\n",
+        f"Request: {request_id}\n",
+        f"{'='*70}\n",
+    ]
 
     before_metrics = parse_metrics_file(before_file) if before_file else None
     after_metrics = parse_metrics_file(after_file) if after_file else None
 
     if not before_metrics:
-        print(f"⚠️  Could not parse 'before' snapshot: {before_file}")
-        return
+        parts.append(f"⚠️  Could not parse 'before' snapshot: {before_file}\n")
+        return ''.join(parts), None
 
     if not after_metrics:
-        print(f"⚠️  Could not parse 'after' snapshot: {after_file}")
-        return
+        parts.append(f"⚠️  Could not parse 'after' snapshot: {after_file}\n")
+        return ''.join(parts), None
 
     # Calculate deltas
     prefill_delta = after_metrics.get('prefill_sum', 0) - before_metrics.get('prefill_sum', 0)
     decode_delta = after_metrics.get('decode_sum', 0) - before_metrics.get('decode_sum', 0)
     ttft_delta = after_metrics.get('ttft_sum', 0) - before_metrics.get('ttft_sum', 0)
 
-    print(f"Snapshot (before): {before_file}")
-    print(f"Snapshot (after):  {after_file}")
-    print(f"\n📊 CALCULATED METRICS:")
-    print(f"  Prefill Time: {prefill_delta:.3f}s")
-    print(f"  Decode Time: {decode_delta:.3f}s")
-    print(f"  Time to First Token (TTFT): {ttft_delta:.3f}s")
+    parts.extend([
+        f"Snapshot (before): {before_file}\n",
+        f"Snapshot (after):  {after_file}\n",
+        "\n📊 CALCULATED METRICS:\n",
+        f"  Prefill Time: {prefill_delta:.3f}s\n",
+        f"  Decode Time: {decode_delta:.3f}s\n",
+        f"  Time to First Token (TTFT): {ttft_delta:.3f}s\n",
+    ])
 
     if prefill_delta == 0 and decode_delta == 0 and ttft_delta == 0:
-        print(f"\n⚠️  WARNING: All deltas are zero - metrics may not have changed between snapshots")
+        parts.append("\n⚠️  WARNING: All deltas are zero - metrics may not have changed between snapshots\n")
 
-    return {
+    return ''.join(parts), {
         'request_id': request_id,
         'prefill_time': prefill_delta,
         'decode_time': decode_delta,
@@ -126,6 +156,14 @@ def calculate_request_metrics(request_id, before_file, after_file):
     }
 
 
+def calculate_request_metrics(request_id, before_file, after_file):
+    """Calculate timing metrics for a request from before/after snapshots."""
+    # Write the whole report to stdout in one call
+    report, result = _request_report(request_id, before_file, after_file)
+    sys.stdout.write(report)
+    return result
+
+
 def main():
     snapshots_dir = Path("/home/jiaheng/vllm_log/metrics_snapshots")
 
@@ -143,13 +181,32 @@ def main():
 
     print(f"\nFound {len(requests)} request(s) with snapshots\n")
 
+    # Parse the complete pairs across worker processes; map() returns the
+    # reports in submission order, and they are printed in that order below
+    pairs = [
+        (request_id, files['before'], files['after'])
+        for request_id, files in sorted(requests.items())
+        if files.get('before') and files.get('after')
+    ]
+    reports = {}
+    if pairs:
+        request_ids, before_files, after_files = zip(*pairs)
+        # Flush first so forked workers do not inherit (and repeat) output
+        sys.stdout.flush()
+        with ProcessPoolExecutor() as executor:
+            chunksize = max(1, len(pairs) // (4 * (os.cpu_count() or 1)))
+            reports = dict(zip(request_ids, executor.map(
+                _request_report, request_ids, before_files, after_files, chunksize=chunksize
+            )))
+
     results = []
     for request_id, files in sorted(requests.items()):
         before_file = files.get('before')
         after_file = files.get('after')
 
-        if before_file and after_file:
-            result = calculate_request_metrics(request_id, before_file, after_file)
+        if request_id in reports:
+            report, result = reports[request_id]
+            sys.stdout.write(report)
             if result:
                 results.append(result)
         else:
@@ -4,9 +4,13 @@ Custom logging handler for VLLM that stores each request in a separate file.
 import logging
 import os
 import re
-from datetime import datetime
+import time
+from collections import OrderedDict
 from pathlib import Path
 
+# Pattern matches both "request_id=xxx" and VLLM's "request chatcmpl-xxx" format
+_REQUEST_RE = re.compile(r'(?:request_id[=:\s]+|request\s+)(chatcmpl-[a-f0-9]+|[a-zA-Z0-9\-_]+)')
+
 
 class PerRequestFileHandler(logging.Handler):
     """
@@ -14,6 +18,15 @@ class PerRequestFileHandler(logging.Handler):
     Files are organized by request_id extracted from log messages.
     """
 
+    # How many records may sit in the write buffers before every open file
+    # is flushed
+    FLUSH_EVERY = 256
+    # Flags for the raw request file descriptors; O_APPEND keeps each write
+    # at the end of the file even if another process appends too
+    OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, 'O_CLOEXEC', 0)
+    # Cap on simultaneously open request files (least recently used closed)
+    MAX_OPEN = 512
+
     def __init__(self, log_directory="/home/jiaheng/vllm_log/requests",
                  level=logging.INFO):
         """
@@ -27,10 +40,12 @@ class PerRequestFileHandler(logging.Handler):
         self.log_directory = Path(log_directory)
         self.log_directory.mkdir(parents=True, exist_ok=True)
 
-        # Cache for open file handlers to avoid reopening files
-        self._file_handlers = {}
-        # Pattern matches both "request_id=xxx" and VLLM's "request chatcmpl-xxx" format
-        self._request_pattern = re.compile(r'(?:request_id[=:\s]+|request\s+)(chatcmpl-[a-f0-9]+|[a-zA-Z0-9\-_]+)')
+        # LRU cache of open file descriptors to avoid reopening files
+        self._file_handlers = OrderedDict()
+        # Encoded records not yet written, per file descriptor
+        self._pending = {}
+        # Records buffered since the last flush
+        self._unflushed = 0
 
     def extract_request_id(self, record):
         """
@@ -42,12 +57,14 @@ class PerRequestFileHandler(logging.Handler):
         3. Falls back to 'general' for non-request logs
         """
         # Check if request_id is set as an attribute
-        if hasattr(record, 'request_id'):
-            return str(record.request_id)
-
-        # Try to extract from message
-        message = record.getMessage()
-        match = self._request_pattern.search(message)
+        request_id = getattr(record, 'request_id', None)
+        if request_id is not None:
+            return str(request_id)
+
+        # Try to extract from message, skipping the % formatting when
+        # there are no args to interpolate
+        message = record.getMessage() if record.args else str(record.msg)
+        match = _REQUEST_RE.search(message)
         if match:
             return match.group(1)
 
@@ -63,11 +80,11 @@ class PerRequestFileHandler(logging.Handler):
         """
         Generate filename for a given request_id.
 
-        Format: request_{request_id}_{timestamp}.log
+        Format: request_{request_id}.log, or general_{timestamp}.log
         """
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-
         if request_id == 'general':
+            # Only the general file is timestamped, so format the time here
+            timestamp = time.strftime('%Y%m%d_%H%M%S')
             return self.log_directory / f"{request_id}_{timestamp}.log"
         else:
             # For specific requests, use just the request_id
@@ -80,33 +97,84 @@ class PerRequestFileHandler(logging.Handler):
         try:
             request_id = self.extract_request_id(record)
 
-            # Get or create file handler for this request
-            if request_id not in self._file_handlers:
+            # Get or create the file descriptor for this request
+            fd = self._file_handlers.get(request_id)
+            if fd is None:
+                # Close the least recently used file when at the cap; the
+                # general file is kept since its name is timestamped per open
+                if len(self._file_handlers) >= self.MAX_OPEN:
+                    if next(iter(self._file_handlers)) == 'general':
+                        self._file_handlers.move_to_end('general')
+                    _, evicted = self._file_handlers.popitem(last=False)
+                    self._close_fd(evicted)
                 log_file = self.get_log_filename(request_id)
-                # Open in append mode
-                file_handler = open(log_file, 'a', encoding='utf-8')
-                self._file_handlers[request_id] = file_handler
-
-            file_handler = self._file_handlers[request_id]
-
-            # Format and write the message
+                # Open in append mode, so a reopened request file is continued
+                fd = os.open(log_file, self.OPEN_FLAGS, 0o666)
+                self._file_handlers[request_id] = fd
+                self._pending[fd] = []
+            else:
+                self._file_handlers.move_to_end(request_id)
+
+            # Format and buffer the message, encoded once
             msg = self.format(record)
-            file_handler.write(msg + '\n')
-            file_handler.flush()
+            self._pending[fd].append((msg + '\n').encode('utf-8'))
+
+            # Flush in batches rather than once per record
+            self._unflushed += 1
+            if self._unflushed >= self.FLUSH_EVERY:
+                self.flush()
 
         except Exception as e:
             self.handleError(record)
 
+    def _write_pending(self, fd):
+        """
+        Write the buffered records for one file descriptor with os.write.
+        """
+        chunks = self._pending[fd]
+        if not chunks:
+            return
+        data = memoryview(b''.join(chunks))
+        chunks.clear()
+        while data:
+            data = data[os.write(fd, data):]
+
+    def _close_fd(self, fd):
+        """
+        Write out and close one file descriptor.
+        """
+        try:
+            self._write_pending(fd)
+        finally:
+            del self._pending[fd]
+            os.close(fd)
+
+    def flush(self):
+        """
+        Write the buffered records of all open files.
+        """
+        self.acquire()
+        try:
+            for fd in self._file_handlers.values():
+                self._write_pending(fd)
+            self._unflushed = 0
+        finally:
+            self.release()
+
     def close(self):
         """
-        Close all open file handlers.
+        Close all open file descriptors.
         """
-        for file_handler in self._file_handlers.values():
-            try:
-                file_handler.close()
-            except:
-                pass
-        self._file_handlers.clear()
+        self.acquire()
+        try:
+            for fd in self._file_handlers.values():
+                try:
+                    self._close_fd(fd)
+                except OSError:
+                    pass
+            self._file_handlers.clear()
+        finally:
+            self.release()
         super().close()
 
 
@@ -8,21 +8,39 @@ Usage:
     1. Run: python simple_request_monitor.py
     2. Point your agent to http://localhost:11435 (instead of 11434)
     3. Check logs in /home/jiaheng/vllm_log/image_metadata/
+
+    Pass --size-only to log image sizes without decoding anything for dimensions.
 """
 
-import json
-import base64
-import io
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse
-import requests
-from PIL import Image
+import aiohttp
+from aiohttp import web
+
+try:
+    import orjson as _json  # C JSON parser; loads() takes bytes directly
+except ImportError:
+    import json as _json
+
+# Image metadata and per-request file lines, shared with the middleware
+from image_logging_middleware import _image_file_lines, _image_metadata
+
+# Chunk size used to stream VLLM responses back to the client
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Largest request body accepted from agents (aiohttp's default is 1 MB,
+# too small for requests carrying base64 screenshots)
+_MAX_REQUEST_BYTES = 512 * 1024 * 1024
+
 
+class VLLMProxyHandler:
+    """
+    Async proxy that logs image metadata and forwards to VLLM.
 
-class VLLMProxyHandler(BaseHTTPRequestHandler):
-    """Proxy handler that logs image metadata and forwards to VLLM."""
+    Client reads, the forward to VLLM and the streamed response are all
+    non-blocking, so concurrent agents are served in parallel on one loop.
+    """
 
     # VLLM server location
     VLLM_HOST = "localhost"
@@ -31,14 +49,30 @@ class VLLMProxyHandler(BaseHTTPRequestHandler):
     # Log directory
     LOG_DIR = Path("/home/jiaheng/vllm_log/image_metadata")
 
-    def __init__(self, *args, **kwargs):
+    # Image decoding and logging run here so forwarding is not held up
+    _EXECUTOR = ThreadPoolExecutor(max_workers=4)
+
+    def __init__(self, size_only=False):
+        """
+        Args:
+            size_only: Log only each image's size (from the base64 length)
+                and header-sniffed format, without measuring dimensions
+        """
+        self.size_only = size_only
         self.LOG_DIR.mkdir(parents=True, exist_ok=True)
-        super().__init__(*args, **kwargs)
+        # Shared keep-alive session to VLLM, created when the app starts
+        self._session = None
+
+    def extract_and_log_images(self, request_body, path):
+        """Extract image metadata from the raw (bytes) request body."""
+        # Text-only requests never mention image_url; skip parsing them
+        if b'"image_url"' not in request_body:
+            return None
 
-    def extract_and_log_images(self, request_body):
-        """Extract image metadata from request body."""
         try:
-            data = json.loads(request_body)
+            # Both orjson and json parse bytes directly, so the body is never
+            # decoded into a separate str first
+            data = _json.loads(request_body)
         except:
             return None
 
@@ -57,21 +91,13 @@ class VLLMProxyHandler(BaseHTTPRequestHandler):
 
                             if url.startswith('data:image'):
                                 try:
-                                    # Extract base64 data
-                                    header, base64_data = url.split(',', 1)
-                                    image_bytes = base64.b64decode(base64_data)
-
-                                    # Open image to get dimensions
-                                    img = Image.open(io.BytesIO(image_bytes))
-
-                                    images.append({
-                                        'width': img.width,
-                                        'height': img.height,
-                                        'format': img.format,
-                                        'mode': img.mode,
-                                        'size_bytes': len(image_bytes),
-                                        'size_kb': round(len(image_bytes) / 1024, 2)
-                                    })
+                                    # Base64 data starts after the comma;
+                                    # read it in place rather than splitting
+                                    start = url.index(',') + 1
+
+                                    images.append(
+                                        _image_metadata(url, cheap_mode=self.size_only, start=start)
+                                    )
                                 except Exception as e:
                                     print(f"  Error decoding image: {e}")
 
@@ -80,97 +106,115 @@ class VLLMProxyHandler(BaseHTTPRequestHandler):
             timestamp = datetime.now()
             log_file = self.LOG_DIR / f"request_{timestamp.strftime('%Y%m%d_%H%M%S_%f')}.txt"
 
-            with open(log_file, 'w') as f:
-                f.write(f"Timestamp: {timestamp.isoformat()}\n")
-                f.write(f"Path: {self.path}\n")
-                f.write(f"Total Images: {len(images)}\n\n")
-
-                for idx, img in enumerate(images, 1):
-                    f.write(f"Image {idx}:\n")
-                    f.write(f"  Dimensions: {img['width']}x{img['height']} pixels\n")
-                    f.write(f"  Format: {img['format']}\n")
-                    f.write(f"  Color Mode: {img['mode']}\n")
-                    f.write(f"  Size: {img['size_kb']} KB ({img['size_bytes']} bytes)\n")
-                    f.write(f"  Aspect Ratio: {img['width']/img['height']:.2f}:1\n")
-                    f.write("\n")
-
-            # Also log to console
-            print(f"\n✓ Intercepted request with {len(images)} image(s)")
+            # Build the whole file, then write it with a single call
+            lines = [
+                f"Timestamp: {timestamp.isoformat()}\n",
+                f"Path: {path}\n",
+                f"Total Images: {len(images)}\n\n",
+            ]
             for idx, img in enumerate(images, 1):
-                print(f"  Image {idx}: {img['width']}x{img['height']} {img['format']} ({img['size_kb']} KB)")
-            print(f"  Logged to: {log_file.name}")
+                lines.extend(_image_file_lines(idx, img))
 
-        return len(images) if images else None
+            with open(log_file, 'w') as f:
+                f.write(''.join(lines))
 
-    def do_POST(self):
-        """Handle POST requests."""
-        # Read request body
-        content_length = int(self.headers.get('Content-Length', 0))
-        request_body = self.rfile.read(content_length)
+            # Also log to console, as one print so output from concurrent
+            # requests does not interleave
+            console = [f"\n✓ Intercepted request with {len(images)} image(s)"]
+            for idx, img in enumerate(images, 1):
+                if img['width'] is None:
+                    console.append(f"  Image {idx}: {img['format']} ({img['size_kb']} KB)")
+                    continue
+                console.append(f"  Image {idx}: {img['width']}x{img['height']} {img['format']} ({img['size_kb']} KB)")
+            console.append(f"  Logged to: {log_file.name}")
+            print("\n".join(console))
 
-        # Extract and log images
-        self.extract_and_log_images(request_body.decode('utf-8'))
+        return len(images) if images else None
 
-        # Forward to VLLM
+    @staticmethod
+    def _report_logging_error(future):
+        """Print an error raised by a background extract_and_log_images call."""
+        error = future.exception()
+        if error is not None:
+            print(f"✗ Error logging images: {error}")
+
+    async def _client_session(self, app):
+        """Cleanup context: one pooled ClientSession for the app's lifetime."""
+        # No overall timeout (generations can be long), and responses are
+        # relayed still encoded so their headers can be forwarded unchanged
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=256),
+            timeout=aiohttp.ClientTimeout(total=None),
+            auto_decompress=False,
+        )
+        yield
+        await self._session.close()
+
+    async def proxy(self, request):
+        """Forward a request to VLLM and stream the response back."""
+        path = request.path_qs
+        request_body = await request.read()
+
+        if request.method == 'POST':
+            # Extract and log images in the background (the body stays
+            # bytes; it is forwarded as is) while the request goes on to VLLM
+            future = self._EXECUTOR.submit(self.extract_and_log_images, request_body, path)
+            future.add_done_callback(self._report_logging_error)
+
+        vllm_url = f"http://{self.VLLM_HOST}:{self.VLLM_PORT}{path}"
+
+        # Forward headers
+        headers = {
+            key: value for key, value in request.headers.items()
+            if key.lower() not in ['host', 'content-length']
+        }
+
+        response = None
         try:
-            vllm_url = f"http://{self.VLLM_HOST}:{self.VLLM_PORT}{self.path}"
-
-            # Forward headers
-            headers = {
-                key: value for key, value in self.headers.items()
-                if key.lower() not in ['host', 'content-length']
-            }
-
-            # Make request to VLLM
-            response = requests.post(
-                vllm_url,
-                data=request_body,
-                headers=headers,
-                stream=True
-            )
-
-            # Send response back to client
-            self.send_response(response.status_code)
-
-            # Forward response headers
-            for key, value in response.headers.items():
-                if key.lower() not in ['transfer-encoding', 'content-encoding']:
-                    self.send_header(key, value)
-            self.end_headers()
-
-            # Stream response body
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    self.wfile.write(chunk)
-
-        except Exception as e:
+            async with self._session.request(request.method, vllm_url,
+                                             data=request_body or None,
+                                             headers=headers,
+                                             skip_auto_headers=['Content-Type']) as upstream:
+                # Forward response headers
+                response = web.StreamResponse(
+                    status=upstream.status,
+                    headers=[
+                        (key, value) for key, value in upstream.headers.items()
+                        if key.lower() not in ['transfer-encoding', 'connection']
+                    ],
+                )
+                await response.prepare(request)
+
+                # Stream response body
+                async for chunk in upstream.content.iter_chunked(_STREAM_CHUNK_SIZE):
+                    await response.write(chunk)
+                await response.write_eof()
+                return response
+
+        except (aiohttp.ClientError, OSError) as e:
             print(f"✗ Error forwarding request: {e}")
-            self.send_error(500, f"Proxy error: {e}")
-
-    def do_GET(self):
-        """Handle GET requests."""
-        try:
-            vllm_url = f"http://{self.VLLM_HOST}:{self.VLLM_PORT}{self.path}"
-            response = requests.get(vllm_url, headers=dict(self.headers))
-
-            self.send_response(response.status_code)
-            for key, value in response.headers.items():
-                if key.lower() not in ['transfer-encoding', 'content-encoding']:
-                    self.send_header(key, value)
-            self.end_headers()
+            if response is not None and response.prepared:
+                # Headers already went out; all we can do is drop the stream
+                return response
+            return web.Response(status=500, text=f"Proxy error: {e}")
 
-            self.wfile.write(response.content)
-
-        except Exception as e:
-            self.send_error(500, f"Proxy error: {e}")
-
-    def log_message(self, format, *args):
-        """Suppress default logging."""
-        pass  # Comment this out to see all HTTP requests
+    def make_app(self):
+        """Build the aiohttp application that proxies every path."""
+        app = web.Application(client_max_size=_MAX_REQUEST_BYTES)
+        app.cleanup_ctx.append(self._client_session)
+        app.router.add_route('*', '/{path:.*}', self.proxy)
+        return app
 
 
 def main():
     """Start the proxy server."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Proxy that logs image sizes sent to VLLM")
+    parser.add_argument('--size-only', action='store_true',
+                        help="Log image sizes and formats only; skip measuring dimensions")
+    args = parser.parse_args()
+
     proxy_port = 8000
 
     print("=" * 70)
@@ -180,6 +224,8 @@ def main():
     print(f"Proxy listening on: 0.0.0.0:{proxy_port} (all interfaces)")
     print(f"Forwarding to VLLM: http://localhost:{VLLMProxyHandler.VLLM_PORT}")
     print(f"Logs directory: {VLLMProxyHandler.LOG_DIR}")
+    if args.size_only:
+        print("Size-only mode: image dimensions are not measured")
     print()
     print("Configure your agent to use:")
     print(f"  http://<server-ip>:{proxy_port}/v1/chat/completions")
@@ -189,13 +235,12 @@ def main():
     print("=" * 70)
     print()
 
-    server = HTTPServer(('0.0.0.0', proxy_port), VLLMProxyHandler)
-
     try:
-        server.serve_forever()
-    except KeyboardInterrupt:
+        web.run_app(VLLMProxyHandler(size_only=args.size_only).make_app(),
+                    host='0.0.0.0', port=proxy_port,
+                    print=None, access_log=None)
+    finally:
         print("\n\nShutting down proxy...")
-        server.shutdown()
         print("✓ Proxy stopped")
 
 
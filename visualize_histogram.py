@@ -6,50 +6,119 @@ Shows distribution of generation tokens, prefill times, decode times, etc.
 """
 
 import requests
-import re
 from typing import Dict, List, Tuple
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def parse_histogram(metrics_text: str, metric_name: str) -> Dict:
-    """Parse a histogram metric from Prometheus text format."""
+# Percentiles reported for each histogram
+_PERCENTILE_TARGETS = [50, 90, 95, 99]
 
-    # Find all bucket entries
-    bucket_pattern = f'{metric_name}_bucket{{[^}}]*le="([^"]+)"[^}}]*}} (\\S+)'
-    buckets = []
 
-    for match in re.finditer(bucket_pattern, metrics_text):
-        le = match.group(1)  # "less than or equal to" value
-        count = float(match.group(2))
+def parse_histograms(metrics_text: str, metric_names: List[str]) -> Dict[str, Dict]:
+    """
+    Parse several histogram metrics from Prometheus text format in one pass.
 
-        if le == "+Inf":
-            le = float('inf')
-        else:
-            le = float(le)
+    Each sample line is routed to its histogram by splitting the
+    _bucket/_sum/_count suffix off its name, so the text is scanned once
+    however many histograms are wanted.
+    """
+    results = {name: {'buckets': [], 'sum': None, 'count': None} for name in metric_names}
 
-        buckets.append((le, count))
-
-    # Get sum and count
-    sum_match = re.search(f'{metric_name}_sum{{[^}}]*}} (\\S+)', metrics_text)
-    count_match = re.search(f'{metric_name}_count{{[^}}]*}} (\\S+)', metrics_text)
+    for line in metrics_text.splitlines():
+        if line.startswith('#'):
+            continue
+        name, brace, rest = line.partition('{')
+        if not brace:
+            continue
+        metric_name, _, suffix = name.rpartition('_')
+        hist = results.get(metric_name)
+        if hist is None:
+            continue
+        labels, sep, value = rest.partition('} ')
+        if not sep:
+            continue
+        value = value.split(' ', 1)[0]
+
+        if suffix == 'bucket':
+            # "less than or equal to" value
+            le_start = labels.find('le="')
+            if le_start == -1:
+                continue
+            le_start += 4
+            le = labels[le_start:labels.index('"', le_start)]
+            le = float('inf') if le == "+Inf" else float(le)
+            hist['buckets'].append((le, float(value)))
+        elif suffix in ('sum', 'count') and hist[suffix] is None:
+            # First sample wins
+            hist[suffix] = float(value)
+
+    for hist in results.values():
+        hist['buckets'].sort()
+        if hist['sum'] is None:
+            hist['sum'] = 0
+        if hist['count'] is None:
+            hist['count'] = 0
+        hist['average'] = hist['sum'] / hist['count'] if hist['count'] > 0 else 0
+    return results
 
-    total_sum = float(sum_match.group(1)) if sum_match else 0
-    total_count = float(count_match.group(1)) if count_match else 0
 
-    return {
-        'buckets': sorted(buckets),
-        'sum': total_sum,
-        'count': total_count,
-        'average': total_sum / total_count if total_count > 0 else 0
-    }
+def parse_histogram(metrics_text: str, metric_name: str) -> Dict:
+    """Parse a histogram metric from Prometheus text format."""
+    return parse_histograms(metrics_text, [metric_name])[metric_name]
 
 
 def calculate_percentiles(buckets: List[Tuple[float, float]], total_count: float) -> Dict[str, float]:
-    """Calculate percentiles from histogram buckets."""
+    """
+    Calculate percentiles from histogram buckets.
+
+    Each target is located with one searchsorted over the cumulative bucket
+    fractions and linearly interpolated within its bucket. Targets that only
+    fall in the +Inf bucket are left out.
+    """
+    if total_count == 0:
+        return {}
+    if np is None:
+        return _calculate_percentiles_py(buckets, total_count)
+
+    finite = [(le, count) for le, count in buckets if le != float('inf')]
+    if not finite:
+        return {}
+    le = np.array([b[0] for b in finite])
+    cum = np.array([b[1] for b in finite])
+    targets = np.array(_PERCENTILE_TARGETS, dtype=float)
+
+    # First bucket whose cumulative percentile reaches each target (the
+    # running max keeps the search valid if merged series are not monotonic)
+    percentile = np.maximum.accumulate((cum / total_count) * 100)
+    idx = np.searchsorted(percentile, targets, side='left')
+    found = idx < len(le)
+    targets, idx = targets[found], idx[found]
+
+    # Bucket lower edge and count below it (0 for the first bucket)
+    prev_le = np.where(idx > 0, le[idx - 1], 0.0)
+    prev_cum = np.where(idx > 0, cum[idx - 1], 0.0)
+    bucket_le, bucket_cum = le[idx], cum[idx]
+
+    # Linear interpolation within the bucket; empty buckets use their edge
+    target_count = (targets / 100) * total_count
+    span = bucket_cum - prev_cum
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = (target_count - prev_cum) / span
+    values = np.where(span > 0, prev_le + fraction * (bucket_le - prev_le), bucket_le)
+
+    return {int(t): float(v) for t, v in zip(targets, values)}
+
+
+def _calculate_percentiles_py(buckets: List[Tuple[float, float]], total_count: float) -> Dict[str, float]:
+    """Pure-Python fallback for calculate_percentiles: walk the buckets in order."""
     if total_count == 0:
         return {}
 
     percentiles = {}
-    targets = [50, 90, 95, 99]
+    targets = _PERCENTILE_TARGETS
 
     prev_le = 0
     prev_count = 0
@@ -98,7 +167,7 @@ def visualize_histogram(hist: Dict, name: str, unit: str = ""):
     percentiles = calculate_percentiles(buckets, total_count)
     if percentiles:
         print("Percentiles:")
-        for p in [50, 90, 95, 99]:
+        for p in _PERCENTILE_TARGETS:
             if p in percentiles:
                 print(f"  P{p}: {percentiles[p]:.2f}{unit}")
         print()
@@ -151,8 +220,10 @@ def main():
         ('vllm:request_time_per_output_token_seconds', 'Time per Output Token', 's'),
     ]
 
+    parsed = parse_histograms(metrics_text, [metric_name for metric_name, _, _ in histograms])
+
     for metric_name, display_name, unit in histograms:
-        hist = parse_histogram(metrics_text, metric_name)
+        hist = parsed[metric_name]
         if hist['count'] > 0:
             visualize_histogram(hist, display_name, unit)
 